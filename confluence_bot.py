@@ -5,8 +5,10 @@ import streamlit as st
 import boto3
 import json
 import logging
+from botocore.config import Config
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from bs4 import BeautifulSoup
+from llm_scheduler import generation_scheduler, SchedulerRejected
 
 # Set up logging
 logging.basicConfig(
@@ -120,13 +122,20 @@ def store_in_chroma(text_chunks):
             logging.error(f"Failed to store chunk {i} in ChromaDB: {e}")
 
 
-def generate_answer_with_bedrock(prompt, model_id="anthropic.claude-3-5-sonnet-20240620-v1:0", region="us-east-1"):
+def generate_answer_with_bedrock(prompt, model_id="anthropic.claude-3-5-sonnet-20240620-v1:0", region="us-east-1", on_queue_update=None):
     """
     Generate a response using AWS Bedrock with the provided prompt.
+    The call goes through the shared generation scheduler, which limits concurrency and retries throttling.
     """
     logging.info("Generating response using AWS Bedrock Claude 3.5 Sonnet.")
-    client = boto3.client("bedrock-runtime", region_name=region)
-    try:
+    # Retries are left to the scheduler, so botocore makes a single attempt per call.
+    client = boto3.client(
+        "bedrock-runtime",
+        region_name=region,
+        config=Config(retries={"max_attempts": 1, "mode": "standard"}),
+    )
+
+    def invoke():
         response = client.invoke_model(
             modelId=model_id,
             body=json.dumps({
@@ -140,15 +149,21 @@ def generate_answer_with_bedrock(prompt, model_id="anthropic.claude-3-5-sonnet-2
             accept="application/json"
         )
         response_body = json.loads(response["body"].read().decode("utf-8"))
-        response_text = "".join(item.get("text", "") for item in response_body["content"])
+        return "".join(item.get("text", "") for item in response_body["content"])
+
+    try:
+        response_text = generation_scheduler.run(invoke, prompt, on_queue_update=on_queue_update)
         logging.info("Successfully generated response from Bedrock.")
         return response_text.strip() if response_text.strip() else "No response generated."
+    except SchedulerRejected as ex:
+        logging.warning(f"Generation request rejected: {ex}")
+        return "The assistant is busy right now, please try again shortly."
     except Exception as ex:
         logging.error(f"Error generating response: {ex}")
         return f"Error generating response: {ex}"
 
 
-def query_chromadb_rag(user_query, top_k=3):
+def query_chromadb_rag(user_query, top_k=3, on_queue_update=None):
     """
     Retrieves relevant Confluence content and generates AI response using Claude 3.5 Sonnet.
     """
@@ -173,7 +188,7 @@ def query_chromadb_rag(user_query, top_k=3):
 
     **Answer:**
     """
-    return generate_answer_with_bedrock(prompt)
+    return generate_answer_with_bedrock(prompt, on_queue_update=on_queue_update)
 
 
 def main():
@@ -204,7 +219,13 @@ def main():
 
     if st.button("🧠 Generate Answer"):
         if user_query:
-            response = query_chromadb_rag(user_query)
+            queue_status = st.empty()
+
+            def show_queue_position(position, queued):
+                queue_status.info(f"⏳ Waiting for a free slot: position {position} of {queued} in queue.")
+
+            response = query_chromadb_rag(user_query, on_queue_update=show_queue_position)
+            queue_status.empty()
             st.markdown("### 🔹 AI Response:")
             st.write(response)
         else:
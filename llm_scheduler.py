@@ -0,0 +1,296 @@
+import os
+import time
+import random
+import logging
+import threading
+from collections import deque
+
+# Error codes Bedrock (via botocore) uses when the account is being rate limited.
+# Matched case-insensitively: errors raised from inside a response stream
+# (EventStreamError) carry lowercase-first event names such as "throttlingException".
+THROTTLING_ERROR_CODES = {
+    "throttlingexception",
+    "toomanyrequestsexception",
+    "serviceunavailableexception",
+}
+
+# Transient model errors that are worth retrying but say nothing about account
+# capacity, so they do not lower the shared concurrency limit.
+RETRYABLE_ERROR_CODES = {
+    "modelnotreadyexception",
+    "modelstreamerrorexception",
+}
+
+
+class SchedulerRejected(Exception):
+    """Base class for requests the scheduler could not serve."""
+
+
+class QueueFullError(SchedulerRejected):
+    """Raised when the wait queue is already at capacity."""
+
+
+class QueueTimeoutError(SchedulerRejected):
+    """Raised when a request could not start before its deadline."""
+
+
+class RetriesExhaustedError(SchedulerRejected):
+    """Raised when a request is still throttled after `max_retries` retries."""
+
+
+def _error_code(exc):
+    response = getattr(exc, "response", None) or {}
+    return (response.get("Error", {}).get("Code") or "").lower()
+
+
+def is_throttling_error(exc):
+    """
+    Returns True if the exception looks like a throttling error from botocore.
+    """
+    return _error_code(exc) in THROTTLING_ERROR_CODES
+
+
+def is_retryable_error(exc):
+    """
+    Returns True if the exception is a transient model error worth retrying.
+    """
+    return _error_code(exc) in RETRYABLE_ERROR_CODES
+
+
+class _Ticket:
+    __slots__ = ("short", "enqueued_at", "deadline")
+
+    def __init__(self, short, enqueued_at, deadline):
+        self.short = short
+        self.enqueued_at = enqueued_at
+        self.deadline = deadline
+
+
+class GenerationScheduler:
+    """
+    Process-wide admission control for LLM generation calls.
+
+    Calls wait in a FIFO queue until a concurrency slot frees up. Short prompts
+    are served ahead of long ones, but a long prompt that has waited longer than
+    `promote_after` seconds goes ahead of short ones that arrived after it, so
+    it cannot starve. Every waiter has a deadline, and the queue itself is
+    bounded.
+
+    Throttling errors are retried in a coordinated way: a throttle lowers the
+    shared concurrency limit by one slot, and only the throttled caller backs
+    off, for a jittered delay that grows with consecutive throttles across all
+    callers, before rejoining the queue at its original place. The limit grows
+    back one slot at a time as calls succeed. Transient model errors are retried
+    the same way but leave the limit alone.
+
+    The scheduler must be the only retry layer, so build the boto3 clients it
+    calls with `Config(retries={"max_attempts": 1, "mode": "standard"})`.
+    Otherwise botocore retries throttles while holding a slot, out of the
+    scheduler's sight, and multiplies the calls sent per request.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=4,
+        max_queue=64,
+        queue_timeout=60.0,
+        short_prompt_chars=2000,
+        promote_after=10.0,
+        max_retries=4,
+        base_backoff=0.5,
+        max_backoff=8.0,
+        poll_interval=0.25,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.short_prompt_chars = short_prompt_chars
+        self.promote_after = promote_after
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._sleep = sleep
+
+        self._cond = threading.Condition()
+        self._short = deque()
+        self._long = deque()
+        self._active = 0
+        self._limit = self.max_concurrency
+        self._next_shrink_at = 0.0
+        self._throttle_streak = 0
+        self._successes = 0
+
+    def snapshot(self):
+        """
+        Returns the current queue and concurrency state.
+        """
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": len(self._short) + len(self._long),
+                "limit": self._limit,
+                "max_concurrency": self.max_concurrency,
+            }
+
+    def run(self, fn, prompt, on_queue_update=None, timeout=None):
+        """
+        Runs `fn()` once a slot is available and returns its result.
+
+        `on_queue_update(position, queued)` is called from the waiting thread
+        whenever the caller's estimated queue position changes. Throttling
+        and transient model errors are retried up to `max_retries` times; a
+        request still throttled after that raises RetriesExhaustedError.
+        Anything else is raised to the caller unchanged.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        now = self._clock()
+        ticket = _Ticket(len(prompt) <= self.short_prompt_chars, now, now + timeout)
+        attempt = 0
+
+        while True:
+            self._acquire(ticket, on_queue_update, retry=attempt > 0)
+            # Anything that escapes fn(), including BaseException, still frees the slot.
+            outcome = "failure"
+            try:
+                result = fn()
+                outcome = "success"
+            except Exception as exc:
+                if is_throttling_error(exc):
+                    outcome = "throttled"
+                elif not is_retryable_error(exc):
+                    raise
+                error = exc
+            finally:
+                delay = self._release(outcome)
+
+            if outcome == "success":
+                return result
+            if attempt >= self.max_retries:
+                if outcome == "throttled":
+                    raise RetriesExhaustedError(f"Still throttled after {self.max_retries} retries.") from error
+                raise error
+            if outcome != "throttled":
+                delay = self._backoff(attempt)
+            attempt += 1
+            logging.warning(f"Generation call failed, retry {attempt}/{self.max_retries} in {delay:.2f}s: {error}")
+            self._sleep(max(0.0, min(delay, ticket.deadline - self._clock())))
+
+    def _acquire(self, ticket, on_queue_update, retry=False):
+        with self._cond:
+            queue = self._short if ticket.short else self._long
+            if not retry and len(self._short) + len(self._long) >= self.max_queue:
+                raise QueueFullError(f"Generation queue is full ({self.max_queue} waiting).")
+            self._enqueue(ticket)
+
+            last_position = None
+            try:
+                while True:
+                    now = self._clock()
+                    order = self._dispatch_order(now)
+                    if order[0] is ticket and self._active < self._limit:
+                        queue.remove(ticket)
+                        self._active += 1
+                        self._cond.notify_all()
+                        return
+                    if now >= ticket.deadline:
+                        raise QueueTimeoutError("Timed out waiting for a free generation slot.")
+
+                    position = order.index(ticket) + 1
+                    if on_queue_update and position != last_position:
+                        last_position = position
+                        queued = len(order)
+                        self._cond.release()
+                        try:
+                            on_queue_update(position, queued)
+                        finally:
+                            self._cond.acquire()
+                        continue
+
+                    self._cond.wait(min(ticket.deadline - now, self.poll_interval))
+            except BaseException:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    self._cond.notify_all()
+                raise
+
+    def _enqueue(self, ticket):
+        # Retries rejoin at their original place, so each deque stays ordered by arrival.
+        queue = self._short if ticket.short else self._long
+        index = len(queue)
+        while index > 0 and queue[index - 1].enqueued_at > ticket.enqueued_at:
+            index -= 1
+        queue.insert(index, ticket)
+
+    def _release(self, outcome):
+        """
+        Frees a slot and adjusts the concurrency limit for the call's outcome.
+
+        `outcome` is "success", "throttled" or "failure"; failures other than
+        throttling leave the limit alone. Returns the back-off delay for a
+        throttled call, otherwise 0.
+        """
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+            if outcome == "failure":
+                return 0.0
+            if outcome == "success":
+                self._throttle_streak = 0
+                self._successes += 1
+                if self._limit < self.max_concurrency and self._successes >= self._limit:
+                    self._limit += 1
+                    self._successes = 0
+                return 0.0
+
+            now = self._clock()
+            delay = self._backoff(self._throttle_streak)
+            # Shrink at most once per back-off window, so a burst of throttles from
+            # calls that were already in flight does not collapse the limit.
+            if now >= self._next_shrink_at:
+                self._limit = max(1, self._limit - 1)
+                self._throttle_streak += 1
+                self._next_shrink_at = now + delay
+            self._successes = 0
+            logging.info(f"Throttled: concurrency limit {self._limit}, backing off {delay:.2f}s.")
+            return delay
+
+    def _backoff(self, attempt):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _promoted(self, ticket, now):
+        return now - ticket.enqueued_at >= self.promote_after
+
+    def _dispatch_order(self, now):
+        """
+        Returns the waiting tickets in the order they would be dispatched.
+        """
+        order = []
+        short, long = list(self._short), list(self._long)
+        i = j = 0
+        while i < len(short) or j < len(long):
+            if j < len(long) and (
+                i == len(short)
+                or (self._promoted(long[j], now) and long[j].enqueued_at <= short[i].enqueued_at)
+            ):
+                order.append(long[j])
+                j += 1
+            else:
+                order.append(short[i])
+                i += 1
+        return order
+
+
+# Shared by every Streamlit session in this process, since imported modules are
+# only loaded once while the app script itself is re-run on each interaction.
+generation_scheduler = GenerationScheduler(
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.environ.get("LLM_MAX_QUEUE", "64")),
+    queue_timeout=float(os.environ.get("LLM_QUEUE_TIMEOUT", "60")),
+    short_prompt_chars=int(os.environ.get("LLM_SHORT_PROMPT_CHARS", "2000")),
+    max_retries=int(os.environ.get("LLM_MAX_RETRIES", "4")),
+)
@@ -4,8 +4,10 @@ from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 import json
 import boto3
+from botocore.config import Config
 import logging
 import pickle
+from llm_scheduler import generation_scheduler, SchedulerRejected
 
 # Initialize logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,16 +22,21 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 class BedrockProcessing:
     def __init__(self):
-        self.bedrock = boto3.client("bedrock", region_name="us-east-1")
+        # Retries are left to the generation scheduler, so botocore makes a single attempt per call.
+        self.bedrock = boto3.client(
+            "bedrock",
+            region_name="us-east-1",
+            config=Config(retries={"max_attempts": 1, "mode": "standard"}),
+        )
 
     def clean_text(self, text):
         """Clean and normalize text."""
         text = text.replace('\n', ' ')
         return ' '.join(text.split()).strip()
 
-    def generate_response(self, prompt):
-        """Generate a response using AWS Bedrock."""
-        try:
+    def generate_response(self, prompt, on_queue_update=None):
+        """Generate a response using AWS Bedrock, through the shared generation scheduler."""
+        def invoke():
             body = json.dumps({"inputText": prompt})
             response = self.bedrock.invoke_model_with_response_stream(
                 modelId="amazon.titan-tg1-large",
@@ -44,6 +51,12 @@ class BedrockProcessing:
                     response_text += event["bytes"].decode("utf-8")
 
             return response_text
+
+        try:
+            return generation_scheduler.run(invoke, prompt, on_queue_update=on_queue_update)
+        except SchedulerRejected as e:
+            logging.warning(f"Generation request rejected: {e}")
+            return "The assistant is busy right now, please try again shortly."
         except Exception as e:
             logging.error(f"Error generating response: {e}")
             return "Error generating response."
@@ -129,11 +142,14 @@ def query_knowledge_base(query, knowledge_base):
         return "I'm sorry, I couldn't find relevant information in the PDFs."
 
 # Main chatbot handler
-def chatbot_query_handler(user_query, knowledge_base):
+def chatbot_query_handler(user_query, knowledge_base, on_queue_update=None):
     """Handle user queries with knowledge base search and Bedrock response generation."""
     bedrock_processor = BedrockProcessing()
     retrieval_response = query_knowledge_base(user_query, knowledge_base)
-    final_response = bedrock_processor.generate_response(f"{retrieval_response}\n\nBased on this information, generate a detailed answer.")
+    final_response = bedrock_processor.generate_response(
+        f"{retrieval_response}\n\nBased on this information, generate a detailed answer.",
+        on_queue_update=on_queue_update,
+    )
     return final_response
 
 # Process PDFs and build knowledge base
@@ -0,0 +1,390 @@
+"""
+Checks and load test for the generation scheduler.
+
+First runs deterministic checks of dispatch order, deadlines, queue limits and
+retries against a fake clock. Then starts a local stub of a model endpoint and
+sends the same burst of clients straight at it and through the scheduler, for
+several rounds each, and prints the goodput (answers delivered within the
+deadline per second) of both.
+
+The stub answers 429 (throttled) whenever more than `capacity` calls are in
+flight. To keep the baseline honest it models what calls cost on a real
+endpoint: a throttled call still takes a network round trip
+(`throttle_latency`), and generation time grows with prompt length
+(`latency_per_kchar`), as it does for a model that has to read the prompt.
+
+A third mode runs the scheduler with short-prompt priority turned off
+(`short_prompt_chars=0`, plain FIFO). Long prompts are slower under any order
+because the stub takes longer to answer them, so priority is measured against
+this reference rather than against the long prompts of the same run.
+
+The run fails if the scheduler delivers fewer answers than the baseline (beyond
+a small allowance for run-to-run noise) or if its short prompts are not
+clearly faster than under FIFO.
+
+    python scheduler_loadtest.py --clients 120 --capacity 4 --latency 0.3
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llm_scheduler import (
+    GenerationScheduler,
+    QueueFullError,
+    QueueTimeoutError,
+    RetriesExhaustedError,
+    SchedulerRejected,
+    _Ticket,
+    is_throttling_error,
+)
+
+# Fraction of the baseline's answers the scheduler may fall short by before the
+# run fails; pooled rounds of the same burst vary by about this much.
+GOODPUT_NOISE_ALLOWANCE = 0.02
+
+# Fraction by which short prompts must beat their mean latency under FIFO.
+SHORT_PRIORITY_MARGIN = 0.15
+
+
+class StubThrottled(Exception):
+    """Mimics the shape of a botocore ThrottlingException."""
+
+    def __init__(self, message):
+        super().__init__(message)
+        self.response = {"Error": {"Code": "ThrottlingException", "Message": message}}
+
+
+class StubServer(ThreadingHTTPServer):
+    # Large listen backlog so overload shows up as 429s rather than refused connections.
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def start_stub_endpoint(capacity, latency, jitter, latency_per_kchar, throttle_latency):
+    """
+    Starts the stub endpoint on a free local port and returns the server.
+    """
+    lock = threading.Lock()
+    state = {"in_flight": 0, "calls": 0, "throttled": 0}
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            prompt = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))["prompt"]
+            with lock:
+                state["calls"] += 1
+                overloaded = state["in_flight"] >= capacity
+                if overloaded:
+                    state["throttled"] += 1
+                else:
+                    state["in_flight"] += 1
+            if overloaded:
+                time.sleep(throttle_latency)
+                self._reply(429, {"message": "Too many requests"})
+                return
+            try:
+                time.sleep(latency + latency_per_kchar * len(prompt) / 1000 + random.uniform(0, jitter))
+                self._reply(200, {"content": [{"text": "stub answer"}]})
+            finally:
+                with lock:
+                    state["in_flight"] -= 1
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    server.stats = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def call_stub(url, prompt):
+    """
+    Sends one generation request to the stub endpoint.
+    """
+    request = urllib.request.Request(
+        url,
+        data=json.dumps({"prompt": prompt}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read())["content"][0]["text"]
+    except urllib.error.HTTPError as e:
+        if e.code == 429:
+            raise StubThrottled("Rate exceeded")
+        raise
+
+
+def call_with_independent_retries(url, prompt, give_up_at):
+    """
+    Baseline client: retries throttles on its own schedule, like users pressing the button again.
+    """
+    while True:
+        try:
+            return call_stub(url, prompt)
+        except StubThrottled:
+            if time.monotonic() >= give_up_at:
+                raise
+            time.sleep(random.uniform(0.05, 0.2))
+
+
+def run_burst(url, clients, deadline, scheduler=None):
+    """
+    Fires `clients` concurrent requests and returns per-request outcomes.
+    """
+    results = []
+    results_lock = threading.Lock()
+    start_barrier = threading.Barrier(clients)
+
+    def client(i):
+        # Mix of short and long prompts, as in real traffic.
+        prompt = "q" * (random.choice([200, 200, 200, 5000]))
+        start_barrier.wait()
+        started = time.monotonic()
+        try:
+            if scheduler is None:
+                call_with_independent_retries(url, prompt, started + deadline)
+            else:
+                scheduler.run(lambda: call_stub(url, prompt), prompt, timeout=deadline)
+            outcome = "ok"
+        except StubThrottled:
+            outcome = "throttled"
+        except SchedulerRejected:
+            outcome = "rejected"
+        except Exception:
+            outcome = "error"
+        elapsed = time.monotonic() - started
+        if outcome == "ok" and elapsed > deadline:
+            outcome = "late"
+        with results_lock:
+            results.append((outcome, elapsed, len(prompt)))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    began = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.monotonic() - began
+
+
+class FakeClock:
+    """Clock for the deterministic checks; `step` advances time on every read."""
+
+    def __init__(self, step=0.0):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def check_scheduler():
+    """
+    Deterministic checks of dispatch order, deadlines, queue limits and retries.
+    """
+    clock = FakeClock()
+    scheduler = GenerationScheduler(promote_after=5, clock=clock, sleep=clock.sleep)
+    long_1 = _Ticket(False, 0.0, 100.0)
+    short_1 = _Ticket(True, 1.0, 100.0)
+    short_2 = _Ticket(True, 2.0, 100.0)
+    for ticket in (long_1, short_1, short_2):
+        scheduler._enqueue(ticket)
+    assert scheduler._dispatch_order(3.0) == [short_1, short_2, long_1], "short prompts go first"
+    assert scheduler._dispatch_order(5.0) == [long_1, short_1, short_2], "promoted long passes newer shorts"
+
+    scheduler = GenerationScheduler(promote_after=5, clock=clock, sleep=clock.sleep)
+    short_1 = _Ticket(True, 0.0, 100.0)
+    short_2 = _Ticket(True, 1.0, 100.0)
+    long_1 = _Ticket(False, 2.0, 100.0)
+    for ticket in (short_1, short_2, long_1):
+        scheduler._enqueue(ticket)
+    assert scheduler._dispatch_order(10.0) == [short_1, short_2, long_1], "promoted long never passes older shorts"
+
+    # A retried ticket rejoins at its original place and keeps its age.
+    retried = _Ticket(False, 0.5, 100.0)
+    scheduler._enqueue(retried)
+    assert list(scheduler._long) == [retried, long_1], "retry keeps arrival order"
+    assert scheduler._dispatch_order(6.0) == [short_1, retried, short_2, long_1], "retry keeps promotion"
+
+    clock = FakeClock(step=0.5)
+    scheduler = GenerationScheduler(max_concurrency=1, poll_interval=0, clock=clock, sleep=clock.sleep)
+    scheduler._active = 1
+    try:
+        scheduler.run(lambda: "unreachable", "q", timeout=2)
+        raise AssertionError("expected QueueTimeoutError")
+    except QueueTimeoutError:
+        pass
+    assert scheduler.snapshot()["queued"] == 0, "timed-out ticket leaves the queue"
+
+    scheduler = GenerationScheduler(max_queue=1, clock=clock, sleep=clock.sleep)
+    scheduler._enqueue(_Ticket(True, 0.0, 100.0))
+    try:
+        scheduler.run(lambda: "unreachable", "q")
+        raise AssertionError("expected QueueFullError")
+    except QueueFullError:
+        pass
+
+    clock = FakeClock()
+    scheduler = GenerationScheduler(max_retries=2, base_backoff=1.0, clock=clock, sleep=clock.sleep)
+    failures = [StubThrottled("Rate exceeded"), StubThrottled("Rate exceeded")]
+
+    def flaky():
+        if failures:
+            raise failures.pop()
+        return "answer"
+
+    assert scheduler.run(flaky, "q") == "answer", "throttles are retried"
+    assert clock.now >= 0.5, "retry backs off before rejoining the queue"
+    assert scheduler.snapshot()["limit"] < scheduler.max_concurrency, "throttle lowers the limit"
+
+    limit = scheduler.snapshot()["limit"]
+    for _ in range(3):
+        try:
+            scheduler.run(lambda: 1 / 0, "q")
+        except ZeroDivisionError:
+            pass
+    assert scheduler.snapshot()["limit"] == limit, "other errors do not count as successes"
+    assert scheduler.snapshot()["active"] == 0
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    try:
+        scheduler.run(interrupted, "q")
+        raise AssertionError("expected KeyboardInterrupt")
+    except KeyboardInterrupt:
+        pass
+    assert scheduler.snapshot()["active"] == 0, "BaseException from fn() still frees the slot"
+
+    clock = FakeClock()
+    scheduler = GenerationScheduler(max_retries=2, clock=clock, sleep=clock.sleep)
+    try:
+        scheduler.run(lambda: (_ for _ in ()).throw(StubThrottled("Rate exceeded")), "q")
+        raise AssertionError("expected RetriesExhaustedError")
+    except RetriesExhaustedError as e:
+        assert isinstance(e.__cause__, StubThrottled), "exhausted retry chains the last throttle"
+
+    scheduler = GenerationScheduler(max_retries=2, clock=clock, sleep=clock.sleep)
+    stream_failures = [Exception("model stream error"), Exception("model stream error")]
+    for failure in stream_failures:
+        failure.response = {"Error": {"Code": "modelStreamErrorException"}}
+
+    def stream_flaky():
+        if stream_failures:
+            raise stream_failures.pop()
+        return "answer"
+
+    assert scheduler.run(stream_flaky, "q") == "answer", "transient model errors are retried"
+    assert scheduler.snapshot()["limit"] == scheduler.max_concurrency, "transient model errors keep the limit"
+
+    stream_error = Exception("stream throttled")
+    stream_error.response = {"Error": {"Code": "throttlingException"}}
+    assert is_throttling_error(stream_error), "event-stream codes are matched case-insensitively"
+    print("Scheduler checks passed.")
+
+
+def summarize(label, deadline, results, wall_time, calls, throttled):
+    counts = {}
+    for outcome, _, _ in results:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    ok_latencies = sorted(elapsed for outcome, elapsed, _ in results if outcome == "ok")
+    ok_short = [e for outcome, e, size in results if outcome == "ok" and size <= 2000]
+    ok_long = [e for outcome, e, size in results if outcome == "ok" and size > 2000]
+
+    def percentile(values, p):
+        return values[min(len(values) - 1, int(p * len(values)))] if values else float("nan")
+
+    def mean(values):
+        return sum(values) / len(values) if values else float("nan")
+
+    print(f"\n== {label} ==")
+    print(f"  outcomes:        {counts}")
+    print(f"  success rate:    {counts.get('ok', 0) / len(results):.0%} within {deadline:.0f}s deadline")
+    print(f"  goodput:         {counts.get('ok', 0) / wall_time:.2f} answers/s over {wall_time:.2f}s")
+    print(f"  endpoint calls:  {calls} ({throttled} throttled)")
+    print(f"  latency p50/p95: {percentile(ok_latencies, 0.5):.2f}s / {percentile(ok_latencies, 0.95):.2f}s")
+    print(f"  mean short/long: {mean(ok_short):.2f}s / {mean(ok_long):.2f}s")
+    return counts.get("ok", 0), mean(ok_short), mean(ok_long)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and load test the generation scheduler against a local stub.")
+    parser.add_argument("--clients", type=int, default=120)
+    parser.add_argument("--capacity", type=int, default=4, help="Concurrent calls the stub accepts before throttling.")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--latency-per-kchar", type=float, default=0.05, help="Extra generation time per 1000 prompt characters.")
+    parser.add_argument("--throttle-latency", type=float, default=0.05, help="Round trip of a throttled call.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Scheduler concurrency limit (deliberately above capacity).")
+    parser.add_argument("--deadline", type=float, default=10.0)
+    parser.add_argument("--rounds", type=int, default=3, help="Bursts per mode; results are pooled.")
+    args = parser.parse_args()
+
+    check_scheduler()
+    server = start_stub_endpoint(
+        args.capacity, args.latency, args.jitter, args.latency_per_kchar, args.throttle_latency
+    )
+    url = f"http://127.0.0.1:{server.server_address[1]}/invoke"
+    modes = ("baseline", "fifo", "scheduler")
+    runs = {mode: {"results": [], "wall_time": 0.0, "calls": 0, "throttled": 0} for mode in modes}
+    try:
+        # Alternate the modes so drift on the machine affects all of them alike.
+        for _ in range(args.rounds):
+            for mode in modes:
+                scheduler = None
+                if mode != "baseline":
+                    scheduler = GenerationScheduler(
+                        max_concurrency=args.concurrency,
+                        max_queue=args.clients,
+                        queue_timeout=args.deadline,
+                        # With no prompt counted as short, every request waits in one FIFO queue.
+                        short_prompt_chars=0 if mode == "fifo" else 2000,
+                        # Long prompts jump ahead of newer short ones only once they risk missing the deadline.
+                        promote_after=args.deadline * 0.6,
+                        base_backoff=0.1,
+                        max_backoff=1.0,
+                        max_retries=8,
+                    )
+                calls, throttled = server.stats["calls"], server.stats["throttled"]
+                results, wall_time = run_burst(url, args.clients, args.deadline, scheduler)
+                run = runs[mode]
+                run["results"].extend(results)
+                run["wall_time"] += wall_time
+                run["calls"] += server.stats["calls"] - calls
+                run["throttled"] += server.stats["throttled"] - throttled
+    finally:
+        server.shutdown()
+
+    baseline_ok, _, _ = summarize("Unbounded, independent retries", args.deadline, **runs["baseline"])
+    _, fifo_short_latency, _ = summarize("GenerationScheduler, FIFO (no short priority)", args.deadline, **runs["fifo"])
+    scheduler_ok, short_latency, _ = summarize("GenerationScheduler", args.deadline, **runs["scheduler"])
+
+    assert scheduler_ok >= baseline_ok * (1 - GOODPUT_NOISE_ALLOWANCE), (
+        f"scheduler answered {scheduler_ok}, baseline {baseline_ok}"
+    )
+    assert short_latency <= fifo_short_latency * (1 - SHORT_PRIORITY_MARGIN), (
+        f"short prompts took {short_latency:.2f}s with priority, {fifo_short_latency:.2f}s under FIFO"
+    )
+
+
+if __name__ == "__main__":
+    main()